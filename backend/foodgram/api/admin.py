@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.db.models import Prefetch
 from django.utils.html import format_html
 
+from recipes.images import RENDITION_FIELDS, schedule_renditions
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
                             ShoppingCart, Tag)
 from users.models import User
@@ -29,13 +31,19 @@ class UserAdmin(UserAdmin):
         'email',
     )
 
-    @admin.display(description='Количество подписчиков')
+    @admin.display(
+        description='Количество подписчиков',
+        ordering='followers_count',
+    )
     def get_followers_count(self, obj):
-        return obj.follower.count()
+        return obj.followers_count
 
-    @admin.display(description='Количество рецептов')
+    @admin.display(
+        description='Количество рецептов',
+        ordering='recipes_count',
+    )
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class IngredientInline(admin.TabularInline):
@@ -43,6 +51,9 @@ class IngredientInline(admin.TabularInline):
     model = RecipeIngredient
     extra = 1
     min_num = 1
+    autocomplete_fields = (
+        'ingredient',
+    )
 
 
 @admin.register(Recipe)
@@ -60,23 +71,50 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     search_fields = (
         'name',
-        'author',
+        'author__username',
     )
     list_filter = (
         'tags',
     )
+    list_select_related = (
+        'author',
+    )
+    autocomplete_fields = (
+        'author',
+        'tags',
+    )
+    readonly_fields = RENDITION_FIELDS
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.only('name')),
+            Prefetch(
+                'ingredients',
+                queryset=Ingredient.objects.only('name').order_by('name'),
+            ),
+        )
 
-    @admin.display(description='Добавлено в избранное')
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            schedule_renditions(obj)
+
+    @admin.display(
+        description='Добавлено в избранное',
+        ordering='favorites_count',
+    )
     def favorite_count(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
     @admin.display(description='Список ингредиентов')
     def ingredients_list(self, obj):
-        return ', '.join(obj.ingredients.values_list('name', flat=True))
+        return ', '.join(
+            ingredient.name for ingredient in obj.ingredients.all()
+        )
 
     @admin.display(description='Список тегов')
     def tags_list(self, obj):
-        return ', '.join(obj.tags.values_list('name', flat=True))
+        return ', '.join(tag.name for tag in obj.tags.all())
 
 
 @admin.register(Favorite)
@@ -87,10 +125,18 @@ class FavoriteAdmin(admin.ModelAdmin):
         'recipe',
     )
     search_fields = (
+        'user__username',
+        'recipe__name',
+    )
+    list_filter = (
         'user',
         'recipe',
     )
-    list_filter = (
+    list_select_related = (
+        'user',
+        'recipe',
+    )
+    autocomplete_fields = (
         'user',
         'recipe',
     )
@@ -142,8 +188,16 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
         'ingredient',
     )
     search_fields = (
+        'recipe__name',
+        'ingredient__name',
+    )
+    list_select_related = (
         'recipe',
-        'ingredient'
+        'ingredient',
+    )
+    autocomplete_fields = (
+        'recipe',
+        'ingredient',
     )
 
 
@@ -154,5 +208,14 @@ class ShoppingCartAdmin(admin.ModelAdmin):
         'user',
     )
     search_fields = (
+        'user__username',
+        'recipe__name',
+    )
+    list_select_related = (
         'user',
+        'recipe',
+    )
+    autocomplete_fields = (
+        'user',
+        'recipe',
     )
@@ -0,0 +1,91 @@
+import csv
+import io
+import os
+
+from foodgram import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+PDF_FONT_SIZE = 12
+PDF_LEADING = 18
+PDF_MARGIN = 50
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class Echo:
+    """Псевдобуфер: возвращает записанную строку вместо хранения."""
+
+    def write(self, value):
+        return value
+
+
+def get_line(number, ingredient):
+    return (
+        f'{number}. {ingredient["ingredient__name"]} '
+        f'{ingredient["amount"]} '
+        f'{ingredient["ingredient__measurement_unit"]}'
+    )
+
+
+def export_txt(cart):
+    """Построчная выгрузка списка покупок в текстовом формате."""
+
+    for number, ingredient in enumerate(cart, start=1):
+        yield f'{get_line(number, ingredient)}\n'
+
+
+def export_csv(cart):
+    """Построчная выгрузка списка покупок в формате CSV."""
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for ingredient in cart:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['amount'],
+            ingredient['ingredient__measurement_unit'],
+        ))
+
+
+def get_pdf_font():
+    font_path = settings.SHOPPING_LIST_FONT
+    if not os.path.exists(font_path):
+        return 'Helvetica'
+    font_name = os.path.splitext(os.path.basename(font_path))[0]
+    if font_name not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(font_name, font_path))
+    return font_name
+
+
+def export_pdf(cart):
+    """Выгрузка списка покупок в формате PDF.
+
+    Таблица ссылок PDF пишется в конце файла, поэтому документ
+    собирается целиком и только потом отдается частями.
+    """
+
+    buffer = io.BytesIO()
+    font = get_pdf_font()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    _, height = A4
+    position = height - PDF_MARGIN
+    pdf.setFont(font, PDF_FONT_SIZE)
+    for number, ingredient in enumerate(cart, start=1):
+        if position < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(font, PDF_FONT_SIZE)
+            position = height - PDF_MARGIN
+        pdf.drawString(PDF_MARGIN, position, get_line(number, ingredient))
+        position -= PDF_LEADING
+    pdf.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+EXPORTERS = {
+    'txt': export_txt,
+    'csv': export_csv,
+    'pdf': export_pdf,
+}
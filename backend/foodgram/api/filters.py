@@ -1,20 +1,123 @@
 import django_filters
+from django import forms
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, TrigramSimilarity)
+from django.db import connection
+from django.db.models import Case, Exists, IntegerField, OuterRef, Q, When
+from django_filters import utils
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 
+from foodgram.settings import SEARCH_CONFIG
+from recipes.indexes import inclusion_index, ingredient_index, tag_registry
 from recipes.models import Recipe
 
 
-class IngredientFilter(filters.SearchFilter):
-    """Фильтр поиска ингредиента по имени."""
+def get_tag_choices():
+    return [(slug, slug) for slug in tag_registry.get_ids()]
+
+
+class TagMultipleChoiceField(django_filters.fields.MultipleChoiceField):
+    """Выбор тегов, перед проверкой обновляющий реестр при промахе."""
+
+    def validate(self, value):
+        tag_registry.get_ids(value)
+        super().validate(value)
+
+
+class TagMultipleChoiceFilter(django_filters.MultipleChoiceFilter):
+    field_class = TagMultipleChoiceField
+
+
+class IntegerInFilter(
+    django_filters.BaseInFilter, django_filters.NumberFilter
+):
+    """Список целых чисел через запятую."""
+
+    field_class = forms.IntegerField
+
+
+class IngredientFilter(filters.BaseFilterBackend):
+    """Фильтр поиска ингредиента по имени через индекс в памяти."""
 
     search_param = 'name'
 
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param)
+        if not name or view.action != 'list':
+            return queryset
+        return ingredient_index.search(name)
+
+
+class UserSearchFilter(filters.SearchFilter):
+    """Фильтр поиска пользователей по имени.
+
+    В PostgreSQL поиск по подстроке обслуживается триграммным
+    индексом, а результаты упорядочиваются по похожести.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        queryset = super().filter_queryset(request, queryset, view)
+        terms = self.get_search_terms(request)
+        if not terms or connection.vendor != 'postgresql':
+            return queryset
+        return queryset.annotate(
+            rank=TrigramSimilarity('username', ' '.join(terms))
+        ).order_by('-rank', 'username')
+
+
+class RecipeFilterBackend(DjangoFilterBackend):
+    """Бэкенд фильтра рецептов с ранжированием по ингредиентам.
+
+    Ранжированный список id не передается в SQL: для списка он
+    сохраняется в view.ranked_ids и разбивается на страницы
+    в RecipesPagination, для остальных действий ограничивает выборку.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        view.ranked_ids = None
+        filterset = self.get_filterset(request, queryset, view)
+        if filterset is None:
+            return queryset
+
+        if not filterset.is_valid() and self.raise_exception:
+            raise utils.translate_validation(filterset.errors)
+        queryset = filterset.qs
+        ranked_ids = getattr(filterset, 'ranked_ids', None)
+        if ranked_ids is None:
+            return queryset
+        if view.action == 'list':
+            view.ranked_ids = ranked_ids
+            return queryset
+        return queryset.filter(pk__in=ranked_ids)
+
 
 class RecipeFilter(django_filters.FilterSet):
     """Фильтр поиска рецептов."""
 
-    tags = django_filters.AllValuesMultipleFilter(
-        field_name='tags__slug'
+    ranked_ids = None
+
+    tags = TagMultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='filter_tags'
+    )
+    ingredients = IntegerInFilter(
+        method='filter_ingredients'
+    )
+    mode = django_filters.ChoiceFilter(
+        choices=(
+            ('any', 'Хотя бы один ингредиент'),
+            ('all', 'Все ингредиенты'),
+            ('only', 'Только эти ингредиенты'),
+        ),
+        method='filter_mode'
+    )
+    tags_mode = django_filters.ChoiceFilter(
+        choices=(
+            ('any', 'Любой из тегов'),
+            ('all', 'Все теги'),
+        ),
+        method='filter_tags_mode'
     )
     is_favorited = django_filters.NumberFilter(
         method='filter_is_favorited_or_in_cart'
@@ -22,16 +125,72 @@ class RecipeFilter(django_filters.FilterSet):
     is_in_shopping_cart = django_filters.NumberFilter(
         method='filter_is_favorited_or_in_cart'
     )
+    search = django_filters.CharFilter(
+        method='filter_search'
+    )
+    ordering = django_filters.ChoiceFilter(
+        choices=(
+            ('popular', 'По популярности'),
+            ('new', 'По дате публикации'),
+        ),
+        method='filter_ordering'
+    )
 
     class Meta:
         model = Recipe
         fields = (
             'tags',
+            'tags_mode',
+            'ingredients',
+            'mode',
             'author',
             'is_favorited',
             'is_in_shopping_cart',
+            'search',
+            'ordering',
         )
 
+    def filter_tags(self, queryset, name, value):
+        """Рецепты с любым или со всеми тегами через EXISTS без дублей."""
+
+        registry = tag_registry.get_ids(value)
+        ids = [registry[slug] for slug in value if slug in registry]
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk')
+        )
+        if self.form.cleaned_data.get('tags_mode') != 'all':
+            return queryset.filter(
+                Exists(recipe_tags.filter(tag_id__in=ids))
+            )
+        for tag_id in ids:
+            queryset = queryset.filter(
+                Exists(recipe_tags.filter(tag_id=tag_id))
+            )
+        return queryset
+
+    def filter_tags_mode(self, queryset, name, value):
+        return queryset
+
+    def filter_ingredients(self, queryset, name, value):
+        """Рецепты по набору ингредиентов, сначала с большим покрытием.
+
+        Запрос не меняется: id рецептов по убыванию покрытия, а при
+        равном покрытии новые первыми, сохраняются в ranked_ids.
+        """
+
+        coverage = inclusion_index.search(
+            value, self.form.cleaned_data.get('mode') or 'any'
+        )
+        self.ranked_ids = [
+            recipe_id
+            for _, recipe_ids in coverage
+            for recipe_id in sorted(recipe_ids, reverse=True)
+        ]
+        return queryset
+
+    def filter_mode(self, queryset, name, value):
+        return queryset
+
     def filter_is_favorited_or_in_cart(self, queryset, name, value):
         filter_dict = {}
         if name == 'is_favorited':
@@ -43,3 +202,35 @@ class RecipeFilter(django_filters.FilterSet):
             queryset = queryset.filter(**filter_dict)
 
         return queryset
+
+    def filter_ordering(self, queryset, name, value):
+        if value == 'popular':
+            return queryset.order_by('-favorites_count', '-pub_date')
+        return queryset.order_by('-pub_date', '-id')
+
+    def filter_search(self, queryset, name, value):
+        if connection.vendor != 'postgresql':
+            return queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value)
+            ).annotate(
+                rank=Case(
+                    When(name__icontains=value, then=1),
+                    default=0,
+                    output_field=IntegerField(),
+                )
+            ).order_by('-rank', '-pub_date')
+
+        vector = SearchVector('name', 'text', config=SEARCH_CONFIG)
+        query = SearchQuery(
+            value,
+            config=SEARCH_CONFIG,
+            search_type='websearch',
+        )
+        return queryset.annotate(
+            search=vector
+        ).filter(
+            Q(search=query) | Q(name__icontains=value)
+        ).annotate(
+            rank=SearchRank(vector, query)
+            + TrigramSimilarity('name', value)
+        ).order_by('-rank', '-pub_date')
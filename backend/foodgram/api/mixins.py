@@ -1,10 +1,26 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, Max
 from django.http import Http404, JsonResponse
-from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import mixins, status, viewsets
 from rest_framework.response import Response
 
-from recipes.models import Favorite, ShoppingCart
-from users.models import Follow
+from foodgram.counters import change_counter
+from foodgram.locks import lock_rows
+from recipes.models import CartIngredient, Favorite, ShoppingCart
+from users.models import Follow, User
+
+from .serializers import IdListSerializer
+
+CREATED = 'created'
+DELETED = 'deleted'
+EXISTS = 'exists'
+MISSING = 'missing'
+NOT_FOUND = 'not_found'
+SELF = 'self'
 
 
 class AddDeleteMixin:
@@ -15,77 +31,189 @@ class AddDeleteMixin:
             'model': Follow,
             'fields': ['following_id'],
             'error_message': 'Вы уже подписаны на автора.',
+            'counter': 'followers_count',
             'extra_params': 'many'
         },
         'favorite': {
             'model': Favorite,
             'fields': ['recipe_id'],
-            'error_message': 'Вы уже добавили этот рецепт в избранное.'
+            'error_message': 'Вы уже добавили этот рецепт в избранное.',
+            'counter': 'favorites_count',
         },
         'cart': {
             'model': ShoppingCart,
             'fields': ['recipe_id'],
-            'error_message': 'Вы уже добавили этот рецепт в корзину.'
+            'error_message': 'Вы уже добавили этот рецепт в корзину.',
+            'counter': 'carts_count',
         }
     }
 
-    def add_relation(self, id, handler, serializer):
+    def change_relations(self, ids, handler, add=True):
+        """Создать или удалить связи пользователя с объектами ids.
+
+        Все связи меняются одним запросом под блокировкой строки
+        пользователя, поэтому параллельные запросы не приводят
+        к повторной вставке или двойному изменению счетчиков.
+        Блокировки берутся в одном порядке: сначала пользователи
+        (для подписок вместе с авторами) по возрастанию id, затем
+        объекты со счетчиками и связи, как и при удалении рецепта.
+        bulk_create не отправляет сигналы, поэтому при добавлении
+        счетчики меняются здесь, а при удалении - обработчиками
+        post_delete.
+        Возвращает словарь id -> результат.
+        """
         user = self.request.user
         relation = self.handlers[handler]
-        create_obj = relation['model']
-        to_relation = relation['fields']
-        if handler in ['favorite', 'cart']:
-            try:
-                from_id = self.queryset.filter(id=id).get()
-            except self.queryset.model.DoesNotExist:
+        model = relation['model']
+        field = relation['fields'][0]
+        counter = relation['counter']
+        found = set(
+            self.queryset.filter(id__in=ids).values_list('id', flat=True)
+        )
+        outcomes = dict.fromkeys(ids, NOT_FOUND)
+        if handler == 'follow' and user.id in found:
+            found.discard(user.id)
+            outcomes[user.id] = SELF
+        locked = {user.pk}
+        if handler == 'follow':
+            locked |= found
+        with transaction.atomic():
+            lock_rows(User.objects.filter(pk__in=locked))
+            existing = set(
+                model.objects.filter(
+                    user=user, **{f'{field}__in': found}
+                ).values_list(field, flat=True)
+            )
+            changed = found - existing if add else existing
+            counted = self.queryset.filter(id__in=changed)
+            lock_rows(counted)
+            if add:
+                model.objects.bulk_create(
+                    [model(user=user, **{field: pk}) for pk in changed],
+                    ignore_conflicts=True,
+                )
+                change_counter(counted, counter, 1)
+                if handler == 'cart':
+                    CartIngredient.objects.add_recipes(user, changed)
+            else:
+                model.objects.filter(
+                    user=user, **{f'{field}__in': changed}
+                ).delete()
+        for pk in found:
+            if pk in changed:
+                outcomes[pk] = CREATED if add else DELETED
+            else:
+                outcomes[pk] = EXISTS if add else MISSING
+        return outcomes
+
+    def change_relations_response(self, handler, add):
+        serializer = IdListSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        outcomes = self.change_relations(
+            serializer.validated_data['ids'], handler, add
+        )
+        return Response(
+            [{'id': pk, 'status': outcome} for pk, outcome in outcomes.items()]
+        )
+
+    def add_relation(self, id, handler, serializer):
+        relation = self.handlers[handler]
+        id = int(id)
+        outcome = self.change_relations([id], handler)[id]
+        if outcome == NOT_FOUND:
+            if handler in ['favorite', 'cart']:
                 return JsonResponse(
                     {'error': 'Bad Request'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-        from_id = get_object_or_404(self.queryset, id=id)
-
-        if handler == 'follow' and from_id == user:
+            raise Http404
+        if outcome == SELF:
             error = 'Нельзя подписаться на самого себя.'
             return Response(
                 error,
                 status=status.HTTP_400_BAD_REQUEST
             )
-
-        as_key = dict.fromkeys(to_relation, from_id.id)
-        new_obj, create = create_obj.objects.get_or_create(
-            user=user,
-            **as_key
-        )
-        if not create:
+        if outcome == EXISTS:
             error = relation['error_message']
             return Response(
                 error,
                 status=status.HTTP_400_BAD_REQUEST
             )
         if 'extra_params' in relation:
+            new_obj = relation['model'].objects.select_related(
+                'following'
+            ).get(user=self.request.user, following_id=id)
             serializer = serializer(
                 new_obj, context={'request': self.request}
             )
         else:
-            serializer = serializer(from_id)
+            serializer = serializer(self.queryset.get(id=id))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_relation(self, id, handler):
-        relation = self.handlers[handler]
-        create_obj = relation['model']
-        from_id = get_object_or_404(self.queryset, id=id)
-        as_key = dict.fromkeys(relation['fields'], from_id.id)
-        try:
-            get_object_or_404(
-                create_obj, user=self.request.user,
-                **as_key
-            ).delete()
-        except Http404:
+        id = int(id)
+        outcome = self.change_relations([id], handler, add=False)[id]
+        if outcome == NOT_FOUND:
+            raise Http404
+        if outcome != DELETED:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class ConditionalGetMixin:
+    """Миксин условных GET-запросов (ETag и Last-Modified).
+
+    Версия ресурса проверяется до сериализации, при совпадении
+    с If-None-Match или If-Modified-Since отдается ответ 304.
+    """
+
+    def get_version(self):
+        """Версия таблицы: количество строк и время последнего изменения."""
+
+        version = self.queryset.aggregate(
+            count=Count('id'),
+            updated_at=Max('updated_at'),
+        )
+        return (
+            f'{version["count"]}-{version["updated_at"]}',
+            version['updated_at'],
+        )
+
+    def get_conditional_response(self, request, render, etag, modified=None):
+        etag = quote_etag(etag)
+        modified = int(modified.timestamp()) if modified else None
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=modified,
+        )
+        if response is None:
+            response = render()
+        response['ETag'] = etag
+        if modified:
+            response['Last-Modified'] = http_date(modified)
+        return response
+
+
+class ConditionalReadMixin(ConditionalGetMixin):
+    """Условные GET-запросы для списка и объекта по версии таблицы."""
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            request,
+            partial(super().list, request, *args, **kwargs),
+            *self.get_version(),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            request,
+            partial(super().retrieve, request, *args, **kwargs),
+            *self.get_version(),
+        )
+
+
 class ListCreateRetrieveViewSet(
     mixins.ListModelMixin,
     mixins.CreateModelMixin,
@@ -95,3 +223,4 @@ class ListCreateRetrieveViewSet(
     """ViewSet для методов Get, List, Create, Retrieve."""
 
     lookup_field = 'id'
+    lookup_value_regex = r'\d+'
@@ -1,11 +1,317 @@
+import base64
+import binascii
+import hashlib
+import json
+from functools import partial
+
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, Page
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from foodgram.settings import (COUNT_CACHE_TIMEOUT, COUNT_ESTIMATE_THRESHOLD,
+                               MAX_PAGE_SIZE)
+
+
+class EstimatedPage(Page):
+    """Страница, наличие следующей страницы у которой известно заранее."""
+
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+
+class CachedCountPaginator(DjangoPaginator):
+    """Пагинатор с кэшируемым и оценочным количеством объектов.
+
+    Для выборок без фильтров в PostgreSQL берется оценка планировщика
+    из pg_class.reltuples, если она не меньше COUNT_ESTIMATE_THRESHOLD.
+    Точное количество кэшируется по тексту запроса на
+    COUNT_CACHE_TIMEOUT секунд, если cache_count истинно.
+    """
+
+    count_is_estimated = False
+
+    def __init__(self, *args, cache_count=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_count = cache_count
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return len(self.object_list)
+        if not self.object_list.query.where:
+            estimate = self.get_estimate()
+            if estimate >= COUNT_ESTIMATE_THRESHOLD:
+                self.count_is_estimated = True
+                return estimate
+        if not self.cache_count:
+            return self.object_list.count()
+        sql, params = self.object_list.values('pk').query.sql_with_params()
+        key = 'count:{}'.format(
+            hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        )
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+    def validate_number(self, number):
+        """Номер страницы; при оценочном количестве без верхней границы.
+
+        Оценка может быть меньше настоящего количества, поэтому
+        страницы за num_pages не отклоняются: пустую страницу
+        отклоняет page().
+        """
+
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if not self.count_is_estimated or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        """Страница; при оценочном количестве has_next по лишней строке."""
+
+        number = self.validate_number(number)
+        if not self.count_is_estimated:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        object_list = list(
+            self.object_list[bottom:bottom + self.per_page + 1]
+        )
+        if not object_list and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        return EstimatedPage(
+            object_list[:self.per_page],
+            number,
+            self,
+            has_more=len(object_list) > self.per_page,
+        )
+
+    def get_estimate(self):
+        connection = connections[self.object_list.db]
+        if connection.vendor != 'postgresql':
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                (self.object_list.model._meta.db_table,)
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
 
 
 class RecipesPagination(PageNumberPagination):
-    """Переопределенный класс базового пагинатора - рецепты."""
+    """Переопределенный класс базового пагинатора - рецепты.
+
+    Оценочное количество отмечается заголовком X-Count-Estimated.
+    С параметром cursor страница выбирается по ключу сортировки
+    без OFFSET и COUNT(*): по сортировке, заданной фильтрами, или по
+    cursor_ordering представления. Для ранжированного по ингредиентам
+    списка и сортировки по релевантности курсор не поддерживается.
+    Количество не кэшируется для выборок, зависящих от пользователя:
+    с фильтрами user_filter_params или у представлений с
+    cache_count = False.
+    """
 
+    django_paginator_class = CachedCountPaginator
     page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+    ranked_cursor_message = (
+        'Курсор нельзя использовать вместе с поиском по ингредиентам.'
+    )
+    unsupported_ordering_message = (
+        'Курсор нельзя использовать с сортировкой по релевантности.'
+    )
+    count_estimated_header = 'X-Count-Estimated'
+    user_filter_params = ('is_favorited', 'is_in_shopping_cart')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        ranked_ids = getattr(view, 'ranked_ids', None)
+        if ranked_ids is not None:
+            if self.use_cursor:
+                raise ParseError(self.ranked_cursor_message)
+            return self.paginate_ranked(queryset, ranked_ids, request, view)
+        if not self.use_cursor:
+            self.django_paginator_class = partial(
+                CachedCountPaginator,
+                cache_count=self.can_cache_count(request, view),
+            )
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.ordering = self.get_cursor_ordering(queryset, view)
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+        reverse, values = cursor if cursor else (False, None)
+        ordering = (
+            [self.invert(field) for field in self.ordering]
+            if reverse else self.ordering
+        )
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(ordering, values)
+            )
+
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+        has_next = has_more if not reverse else True
+        has_previous = has_more if reverse else values is not None
+        self.next_cursor = (
+            self.encode_cursor(False, page[-1])
+            if page and has_next else None
+        )
+        self.previous_cursor = (
+            self.encode_cursor(True, page[0])
+            if page and has_previous else None
+        )
+        return page
+
+    def get_cursor_ordering(self, queryset, view):
+        """Ключ курсора по сортировке, заданной фильтрами.
+
+        Без явной сортировки используется cursor_ordering представления.
+        Явная сортировка дополняется первичным ключом, чтобы ключ был
+        уникальным. Сортировка по вычисляемым значениям (например,
+        по релевантности поиска) курсором не поддерживается.
+        """
+
+        if not queryset.query.order_by:
+            return getattr(view, 'cursor_ordering', self.cursor_ordering)
+        opts = queryset.model._meta
+        ordering = []
+        for field in queryset.query.order_by:
+            if not isinstance(field, str):
+                raise ParseError(self.unsupported_ordering_message)
+            name = field.lstrip('-')
+            if name == 'pk':
+                name = opts.pk.name
+            try:
+                opts.get_field(name)
+            except FieldDoesNotExist as error:
+                raise ParseError(self.unsupported_ordering_message) from error
+            ordering.append(f'-{name}' if field.startswith('-') else name)
+        if not any(field.lstrip('-') == opts.pk.name for field in ordering):
+            ordering.append(
+                f'-{opts.pk.name}' if ordering[-1].startswith('-')
+                else opts.pk.name
+            )
+        return tuple(ordering)
+
+    def paginate_ranked(self, queryset, ranked_ids, request, view):
+        """Страница ранжированного списка id.
+
+        Список разбивается на страницы в памяти, количество равно его
+        длине, из базы загружаются только рецепты страницы. Если
+        выборка отфильтрована другими фильтрами, из нее берутся только
+        id, а ее явная сортировка важнее ранжирования.
+        """
+
+        self.django_paginator_class = CachedCountPaginator
+        if queryset.query.where or queryset.query.order_by:
+            ranks = {pk: rank for rank, pk in enumerate(ranked_ids)}
+            ranked_ids = [
+                pk for pk in queryset.values_list('pk', flat=True)
+                if pk in ranks
+            ]
+            if not queryset.query.order_by:
+                ranked_ids.sort(key=ranks.__getitem__)
+        page_ids = super().paginate_queryset(ranked_ids, request, view)
+        if page_ids is None:
+            page_ids = ranked_ids
+        recipes = queryset.in_bulk(page_ids)
+        return [recipes[pk] for pk in page_ids if pk in recipes]
+
+    def can_cache_count(self, request, view):
+        if not getattr(view, 'cache_count', True):
+            return False
+        return not any(
+            request.query_params.get(param) not in (None, '', '0')
+            for param in self.user_filter_params
+        )
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            response = super().get_paginated_response(data)
+            response[self.count_estimated_header] = (
+                'true' if self.page.paginator.count_is_estimated else 'false'
+            )
+            return response
+        return Response({
+            'next': self.get_cursor_link(self.next_cursor),
+            'previous': self.get_cursor_link(self.previous_cursor),
+            'results': data,
+        })
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def get_keyset_filter(ordering, values):
+        """Условие (a, b) < (x, y) с учетом направления сортировки."""
+
+        keyset = Q()
+        for index, field in enumerate(ordering):
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = Q(**{f'{field.lstrip("-")}__{lookup}': values[index]})
+            for previous, value in zip(ordering[:index], values):
+                condition &= Q(**{previous.lstrip('-'): value})
+            keyset |= condition
+        return keyset
+
+    def encode_cursor(self, reverse, obj):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        data = json.dumps([reverse, values], default=str)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, values = json.loads(base64.urlsafe_b64decode(encoded))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return bool(reverse), [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (
+            TypeError, ValueError, ValidationError, binascii.Error
+        ) as error:
+            raise NotFound(self.invalid_cursor_message) from error
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            cursor,
+        )
 
 
 class IngredientPagination(PageNumberPagination):
@@ -0,0 +1,40 @@
+from rest_framework import renderers
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Сам список отдается потоком из представления, рендерер нужен
+    для выбора формата по ?format= или заголовку Accept и для
+    вывода ошибок в выбранном формате.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and 'detail' in data:
+            data = data['detail']
+        return str(data).encode(self.charset)
+
+
+class TextRenderer(ShoppingListRenderer):
+    """Список покупок в текстовом формате."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(ShoppingListRenderer):
+    """Список покупок в формате PDF."""
+
+    media_type = 'application/pdf'
+    format = 'pdf'
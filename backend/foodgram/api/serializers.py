@@ -1,10 +1,15 @@
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.validators import UniqueValidator
 
 from foodgram import settings
-from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.images import schedule_renditions
+from recipes.indexes import inclusion_index
+from recipes.models import (CartIngredient, Ingredient, Recipe,
+                            RecipeIngredient, Tag)
 from users.models import Follow, User
 from users.validators import validate_username
 
@@ -29,14 +34,26 @@ class UserSerializer(serializers.ModelSerializer):
         )
         read_only_fields = fields
 
+    def get_followed_ids(self, follower):
+        """Множество id авторов, на которых подписан пользователь.
+
+        Загружается один раз и хранится в контексте, общем для
+        вложенных сериализаторов, поэтому повторяющиеся авторы
+        на странице рецептов не порождают новых запросов.
+        """
+        if 'followed_ids' not in self.context:
+            self.context['followed_ids'] = set(
+                Follow.objects.filter(
+                    user=follower
+                ).values_list('following_id', flat=True)
+            )
+        return self.context['followed_ids']
+
     def get_is_subscribed(self, obj):
         follower = self.context.get('request').user
         if follower.is_anonymous:
             return False
-        return Follow.objects.filter(
-            user=follower,
-            following=obj
-        ).exists()
+        return obj.id in self.get_followed_ids(follower)
 
 
 class UserRegistrationSerializer(UserSerializer):
@@ -133,6 +150,30 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class RecipeImageField(serializers.ImageField):
+    """Ссылка на подходящую копию изображения рецепта.
+
+    Пока копия не создана, отдается исходное изображение.
+    """
+
+    def __init__(self, rendition, list_rendition=None, **kwargs):
+        self.rendition = rendition
+        self.list_rendition = list_rendition or rendition
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        view = self.context.get('view')
+        rendition = (
+            self.list_rendition
+            if getattr(view, 'action', None) == 'list'
+            else self.rendition
+        )
+        image = getattr(recipe, f'image_{rendition}') or recipe.image
+        return super().to_representation(image)
+
+
 class RecipeIngredientReadSerializer(serializers.ModelSerializer):
     """Сериализатор для чтения модели рецепт-ингредиент."""
 
@@ -161,9 +202,9 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
     """Сериализатор для создания модели рецепт-ингредиент."""
 
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient',
+    id = serializers.IntegerField(
+        min_value=1,
+        source='ingredient_id',
     )
     amount = serializers.IntegerField(
         min_value=settings.MIN_INGR_AMOUNT,
@@ -178,12 +219,47 @@ class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
         )
 
 
+class IdListSerializer(serializers.Serializer):
+    """Сериализатор списка id для пакетных операций."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.MAX_BATCH_SIZE,
+    )
+
+
+class CartIngredientSerializer(serializers.ModelSerializer):
+    """Сериализатор суммарного списка покупок."""
+
+    id = serializers.PrimaryKeyRelatedField(
+        source='ingredient',
+        read_only=True,
+    )
+    name = serializers.CharField(
+        source='ingredient.name',
+    )
+    measurement_unit = serializers.CharField(
+        source='ingredient.measurement_unit',
+    )
+
+    class Meta:
+        model = CartIngredient
+        fields = (
+            'id',
+            'name',
+            'measurement_unit',
+            'amount',
+        )
+        read_only_fields = fields
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     """Сериализатор для чтения рецепта."""
 
     tags = TagSerializer(many=True,)
     author = UserSerializer()
-    image = Base64ImageField()
+    image = RecipeImageField(rendition='full', list_rendition='card')
     ingredients = RecipeIngredientReadSerializer(
         many=True,
         source='recipe_ingredients',
@@ -212,6 +288,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -219,6 +297,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -229,6 +309,8 @@ class RecipeReadSerializer(serializers.ModelSerializer):
 class RecipeInListSerializer(serializers.ModelSerializer):
     """Сериализатор с кратким отображением рецепта."""
 
+    image = RecipeImageField(rendition='thumbnail')
+
     class Meta:
         model = Recipe
         fields = (
@@ -245,9 +327,8 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
     author = UserSerializer(read_only=True)
     image = Base64ImageField()
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
+    tags = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
     )
     ingredients = RecipeIngredientWriteSerializer(
         many=True,
@@ -273,21 +354,33 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
+    @staticmethod
+    def get_objects(model, ids, message):
+        """Объекты model по списку id одним запросом, в порядке ids."""
+
+        objects = model.objects.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in objects]
+        if missing:
+            raise serializers.ValidationError(
+                message.format(', '.join(map(str, missing)))
+            )
+        return [objects[pk] for pk in ids]
+
     def validate_ingredients(self, ingredients):
         if not ingredients:
             raise serializers.ValidationError(
                 'Ингредиенты должны быть заданы.'
             )
-        ingredient_tuples = [
-            (ingredient['ingredient'],
-             ingredient['amount'])
-            for ingredient in ingredients
-        ]
-
-        if len(set(ingredient_tuples)) != len(ingredients):
+        ids = [ingredient['ingredient_id'] for ingredient in ingredients]
+        if len(set(ids)) != len(ids):
             raise serializers.ValidationError(
                 'Такой ингредиент уже в рецепте.'
             )
+        objects = self.get_objects(
+            Ingredient, ids, 'Ингредиенты не найдены: {}.'
+        )
+        for ingredient, obj in zip(ingredients, objects):
+            ingredient['ingredient'] = obj
 
         return ingredients
 
@@ -301,7 +394,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 'Такой тег уже в рецепте.'
             )
 
-        return tags
+        return self.get_objects(Tag, tags, 'Теги не найдены: {}.')
 
     def validate_image(self, image):
         if not image:
@@ -326,13 +419,14 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             [
                 RecipeIngredient(
                     recipe=recipe,
-                    ingredient_id=ingredient.get('ingredient').id,
+                    ingredient_id=ingredient.get('ingredient_id'),
                     amount=ingredient.get('amount')
                 )
                 for ingredient in ingredients
             ]
         )
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('recipe_ingredients')
@@ -342,26 +436,76 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         )
         recipe.tags.set(tags)
         self.create_ingredients(recipe=recipe, ingredients=ingredients)
+        inclusion_index.schedule_refresh(recipe.id)
+        schedule_renditions(recipe)
         return recipe
 
-    def update(self, instance, validated_data):
+    def update_ingredients(self, recipe, ingredients):
+        """Привести ингредиенты рецепта к переданным.
+
+        Удаляются, изменяются и добавляются только отличающиеся строки.
+        Возвращает True, если состав рецепта изменился.
+        """
+        current = {
+            item.ingredient_id: item
+            for item in recipe.recipe_ingredients.all()
+        }
+        submitted = {
+            ingredient['ingredient_id']: ingredient
+            for ingredient in ingredients
+        }
+        removed = current.keys() - submitted.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe,
+                ingredient_id__in=removed,
+            ).delete()
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = submitted.get(ingredient_id, {}).get('amount')
+            if amount is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        added = [
+            ingredient
+            for ingredient_id, ingredient in submitted.items()
+            if ingredient_id not in current
+        ]
+        self.create_ingredients(recipe, added)
+        return bool(removed or changed or added)
 
-        if 'tags' in validated_data:
-            instance.tags.clear()
-            instance.tags.set(validated_data.pop('tags'))
-        else:
+    @transaction.atomic
+    def update(self, instance, validated_data):
+        if 'tags' not in validated_data:
             raise ValidationError('Отсутствует поле tags.')
-
-        if 'recipe_ingredients' in validated_data:
-            RecipeIngredient.objects.filter(recipe=instance).delete()
-            ingredients = validated_data.pop('recipe_ingredients')
-            self.create_ingredients(instance, ingredients)
-        else:
+        if 'recipe_ingredients' not in validated_data:
             raise ValidationError('Отсутствует поле ingredients.')
 
-        return super().update(instance, validated_data)
+        instance.tags.set(validated_data.pop('tags'))
+        if self.update_ingredients(
+            instance, validated_data.pop('recipe_ingredients')
+        ):
+            CartIngredient.objects.schedule_refresh(
+                instance.carts.values_list('user', flat=True)
+            )
+            inclusion_index.schedule_refresh(instance.id)
+
+        recipe = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            schedule_renditions(recipe)
+        return recipe
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ).order_by('ingredient__name'),
+            ),
+        )
         return RecipeReadSerializer(
             instance,
             context={'request': self.context.get('request')}
@@ -380,7 +524,9 @@ class FollowSerializer(serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField(
         method_name='get_recipes',
     )
-    recipes_count = serializers.ReadOnlyField(source='following.recipes.count')
+    recipes_count = serializers.ReadOnlyField(
+        source='following.recipes_count'
+    )
 
     class Meta:
         model = Follow
@@ -396,15 +542,22 @@ class FollowSerializer(serializers.ModelSerializer):
         )
         read_only_fields = fields
 
-    def get_recipes(self, following):
-        request = self.context.get('request')
-        recipes_limit = int(
+    @staticmethod
+    def get_recipes_limit(request):
+        return int(
             request.query_params.get('recipes_limit')
             or 0
         )
-        recipes = Recipe.objects.filter(
-            author=following.following
-        )[:recipes_limit]
+
+    def get_recipes(self, following):
+        request = self.context.get('request')
+        author = following.following
+        if hasattr(author, 'latest_recipes'):
+            recipes = author.latest_recipes
+        else:
+            recipes = Recipe.objects.filter(
+                author=author
+            )[:self.get_recipes_limit(request)]
         serializer = RecipeInListSerializer(
             recipes,
             many=True,
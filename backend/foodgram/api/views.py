@@ -1,27 +1,39 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              Value, Window, prefetch_related_objects)
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import filters, permissions, status, viewsets
+from rest_framework import permissions, status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 
-from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from foodgram import settings
+from foodgram.locks import lock_rows
+from recipes.indexes import inclusion_index, ingredient_index
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
 from users.models import User
 from users.permissions import AuthorOrRead
 
-from .filters import IngredientFilter, RecipeFilter
-from .mixins import AddDeleteMixin, ListCreateRetrieveViewSet
+from .exporters import EXPORTERS
+from .filters import (IngredientFilter, RecipeFilter, RecipeFilterBackend,
+                      UserSearchFilter)
+from .mixins import (AddDeleteMixin, ConditionalGetMixin, ConditionalReadMixin,
+                     ListCreateRetrieveViewSet)
 from .paginators import IngredientPagination, RecipesPagination
-from .serializers import (ChangePasswordSerializer, FollowSerializer,
-                          IngredientSerializer, RecipeInListSerializer,
-                          RecipeReadSerializer, RecipeWriteSerializer,
-                          TagSerializer, UserLoginSerializer,
-                          UserRegistrationSerializer, UserSerializer)
+from .renderers import CSVRenderer, PDFRenderer, TextRenderer
+from .serializers import (CartIngredientSerializer, ChangePasswordSerializer,
+                          FollowSerializer, IngredientSerializer,
+                          RecipeInListSerializer, RecipeReadSerializer,
+                          RecipeWriteSerializer, TagSerializer,
+                          UserLoginSerializer, UserRegistrationSerializer,
+                          UserSerializer)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ConditionalReadMixin, viewsets.ReadOnlyModelViewSet):
     """VieSet для тегов."""
 
     serializer_class = TagSerializer
@@ -29,26 +41,74 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = IngredientPagination
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(ConditionalReadMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet для ингредиентов."""
 
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
     filter_backends = (IngredientFilter,)
-    search_fields = ('^name',)
     pagination_class = IngredientPagination
 
+    def get_version(self):
+        return ingredient_index.get_version()
 
-class RecipeViewSet(AddDeleteMixin, viewsets.ModelViewSet):
+
+class RecipeViewSet(
+    AddDeleteMixin, ConditionalGetMixin, viewsets.ModelViewSet
+):
     """ViewSet для рецептов."""
 
     queryset = Recipe.objects.all()
     lookup_field = 'id'
+    lookup_value_regex = r'\d+'
     permission_classes = (AuthorOrRead,)
     ordering_fields = ('-pub_date',)
     pagination_class = RecipesPagination
+    filter_backends = (RecipeFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_prefetch_plan(self):
+        """План загрузки связанных объектов для чтения рецептов.
+
+        Теги и ингредиенты загружаются отдельным запросом на всю
+        страницу, поэтому число запросов не зависит от её размера.
+        Для одного рецепта они загружаются только после проверки
+        условного запроса. Для изменяющих действий план не применяется:
+        кэш prefetch устарел бы после перезаписи тегов и ингредиентов.
+        """
+        if self.action not in ('list', 'retrieve'):
+            return ()
+        return (
+            Prefetch('tags', queryset=Tag.objects.all()),
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ).order_by('ingredient__name'),
+            ),
+        )
+
+    def get_queryset(self):
+        queryset = self.queryset
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.select_related('author')
+        if self.action == 'list':
+            queryset = queryset.prefetch_related(*self.get_prefetch_plan())
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
     def get_serializer_class(self):
         return (
             RecipeReadSerializer
@@ -56,6 +116,33 @@ class RecipeViewSet(AddDeleteMixin, viewsets.ModelViewSet):
             else RecipeWriteSerializer
         )
 
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+
+        def render():
+            prefetch_related_objects([instance], *self.get_prefetch_plan())
+            return Response(self.get_serializer(instance).data)
+
+        flags = [instance.is_favorited, instance.is_in_shopping_cart]
+        modified = instance.updated_at
+        if request.user.is_authenticated:
+            flags.append(
+                request.user.follower.filter(
+                    following=instance.author_id
+                ).exists()
+            )
+            modified = None
+        return self.get_conditional_response(
+            request,
+            render,
+            '{}-{}-{}'.format(
+                instance.id,
+                instance.updated_at.timestamp(),
+                ''.join(str(int(flag)) for flag in flags),
+            ),
+            modified,
+        )
+
     @action(
         methods=['post'],
         detail=True,
@@ -69,6 +156,19 @@ class RecipeViewSet(AddDeleteMixin, viewsets.ModelViewSet):
     def delete_favorite(self, request, id):
         return self.delete_relation(id, 'favorite')
 
+    @action(
+        methods=['post'],
+        detail=False,
+        url_path='favorite/batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def batch_favorite(self, request):
+        return self.change_relations_response('favorite', add=True)
+
+    @batch_favorite.mapping.delete
+    def batch_delete_favorite(self, request):
+        return self.change_relations_response('favorite', add=False)
+
     @action(
         methods=['post'],
         detail=True,
@@ -82,44 +182,77 @@ class RecipeViewSet(AddDeleteMixin, viewsets.ModelViewSet):
     def delete_cart(self, request, id):
         return self.delete_relation(id, 'cart')
 
+    @action(
+        methods=['post'],
+        detail=False,
+        url_path='shopping_cart/batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def batch_cart(self, request):
+        return self.change_relations_response('cart', add=True)
+
+    @batch_cart.mapping.delete
+    def batch_delete_cart(self, request):
+        return self.change_relations_response('cart', add=False)
+
     @action(
         methods=['get'],
         detail=False,
         url_path='download_shopping_cart',
-        permission_classes=(permissions.IsAuthenticated,)
+        permission_classes=(permissions.IsAuthenticated,),
+        renderer_classes=(TextRenderer, CSVRenderer, PDFRenderer),
     )
     def download_cart(self, request):
         cart = (
-            RecipeIngredient.objects
-            .filter(recipe__carts__user=request.user)
-            .order_by('ingredient__name')
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(amount=Sum('amount'))
+            request.user.cart_ingredients
+            .values(
+                'ingredient__name',
+                'ingredient__measurement_unit',
+                'amount',
+            )
+            .iterator(chunk_size=settings.SHOPPING_LIST_CHUNK_SIZE)
         )
-        content = '\n'.join(
-            [
-                (
-                    f'{ol}. {ingredient["ingredient__name"]} '
-                    f'{ingredient["amount"]} '
-                    f'{ingredient["ingredient__measurement_unit"]}'
-                ) for ol, ingredient in enumerate(list(cart), start=1)
-            ]
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            EXPORTERS[renderer.format](cart),
+            content_type=renderer.media_type,
         )
-        response = HttpResponse(content, content_type='text/plain')
         response['Content-Disposition'] = (
-            'attachment; filename=shopping-list.txt'
+            f'attachment; filename=shopping-list.{renderer.format}'
         )
         return response
 
+    @action(
+        methods=['get'],
+        detail=False,
+        url_path='shopping_cart_summary',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def cart_summary(self, request):
+        serializer = CartIngredientSerializer(
+            request.user.cart_ingredients.select_related('ingredient'),
+            many=True,
+        )
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            inclusion_index.schedule_refresh(instance.id)
+            lock_rows(User.objects.filter(pk=instance.author_id))
+            lock_rows(Recipe.objects.filter(pk=instance.pk))
+            instance.delete()
+
 
 class UserViewSet(AddDeleteMixin, ListCreateRetrieveViewSet):
     """ViewSet для работы с пользователями."""
 
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (UserSearchFilter,)
     search_fields = ('username',)
     pagination_class = RecipesPagination
+    cursor_ordering = ('-id',)
+    cache_count = True
 
     @action(
         methods=['get'],
@@ -136,11 +269,31 @@ class UserViewSet(AddDeleteMixin, ListCreateRetrieveViewSet):
         methods=['get'],
         detail=False,
         url_path='subscriptions',
-        permission_classes=(permissions.IsAuthenticated,)
+        permission_classes=(permissions.IsAuthenticated,),
+        cache_count=False,
     )
     def user_subscriptions(self, request):
-        user = request.user
-        following = user.follower.all()
+        latest_recipes = Recipe.objects.annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        ).filter(
+            row_number__lte=FollowSerializer.get_recipes_limit(request)
+        )
+        following = (
+            request.user.follower
+            .select_related('following')
+            .prefetch_related(
+                Prefetch(
+                    'following__recipes',
+                    queryset=latest_recipes,
+                    to_attr='latest_recipes',
+                )
+            )
+            .order_by('-id')
+        )
         serializer = FollowSerializer(
             self.paginate_queryset(following), many=True,
             context={'request': request}
@@ -160,6 +313,19 @@ class UserViewSet(AddDeleteMixin, ListCreateRetrieveViewSet):
     def delete_subscribtion(self, request, id):
         return self.delete_relation(id, 'follow')
 
+    @action(
+        methods=['post'],
+        detail=False,
+        url_path='subscribe/batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def batch_subscribe(self, request):
+        return self.change_relations_response('follow', add=True)
+
+    @batch_subscribe.mapping.delete
+    def batch_delete_subscribtion(self, request):
+        return self.change_relations_response('follow', add=False)
+
     @action(
         methods=['post'],
         detail=False,
@@ -178,7 +344,7 @@ class UserViewSet(AddDeleteMixin, ListCreateRetrieveViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         user.set_password(serializer.validated_data.get('new_password'))
-        user.save()
+        user.save(update_fields=('password',))
         return Response(
             status=status.HTTP_204_NO_CONTENT
         )
@@ -0,0 +1,26 @@
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete
+
+
+def get_counter_delta(signal, created=False):
+    """Изменение счетчика по сигналу: +1 для новой строки, -1 для удаленной."""
+
+    if signal is post_delete:
+        return -1
+    return 1 if created else 0
+
+
+def change_counter(queryset, counter, delta):
+    """Изменить счетчик у строк выборки, не опуская его ниже нуля.
+
+    Счетчики хранятся в PositiveIntegerField, поэтому уменьшение
+    рассинхронизированного счетчика ниже нуля нарушило бы CHECK.
+    """
+
+    if not delta:
+        return 0
+    value = F(counter) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    return queryset.update(**{counter: value})
@@ -0,0 +1,21 @@
+from django.contrib.postgres.indexes import GinIndex
+
+
+class PostgresGinIndex(GinIndex):
+    """GIN-индекс, который создается только в PostgreSQL.
+
+    В других СУБД (например, SQLite при локальной разработке) индекс
+    пропускается, а поиск работает без него. Редактор схемы выполняет
+    возвращенный запрос как есть, поэтому вместо None возвращается
+    пустой запрос.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return ''
+        return super().create_sql(model, schema_editor, using, **kwargs)
+
+    def remove_sql(self, model, schema_editor, **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return ''
+        return super().remove_sql(model, schema_editor, **kwargs)
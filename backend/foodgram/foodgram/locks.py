@@ -0,0 +1,13 @@
+def lock_rows(queryset):
+    """Заблокировать строки выборки до конца транзакции.
+
+    Строки блокируются в порядке первичного ключа, поэтому
+    транзакции, блокирующие пересекающиеся наборы строк,
+    не ждут друг друга по кругу.
+    """
+
+    list(
+        queryset.select_for_update()
+        .order_by('pk')
+        .values_list('pk', flat=True)
+    )
@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -72,6 +73,19 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': (
+        {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+        if os.getenv('REDIS_URL') else
+        {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    )
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -101,6 +115,15 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/media'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'emails')
 
@@ -110,6 +133,8 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
+        'users.authentication.CachedTokenAuthentication'
+        if os.getenv('REDIS_URL') else
         'rest_framework.authentication.TokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -149,3 +174,38 @@ MAX_INGR_AMOUNT = 1000
 MIN_COOKING_TIME = 1
 
 MAX_COOKING_TIME = 300
+
+SHOPPING_LIST_CHUNK_SIZE = 500
+
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+INGREDIENT_INDEX_TTL = 300
+
+TAG_REGISTRY_TTL = 300
+
+RECIPE_INCLUSION_INDEX_TTL = 600
+
+SEARCH_CONFIG = 'russian'
+
+MAX_PAGE_SIZE = 100
+
+MAX_BATCH_SIZE = 100
+
+COUNT_CACHE_TIMEOUT = 30
+
+COUNT_ESTIMATE_THRESHOLD = 10000
+
+RECIPE_IMAGE_RENDITIONS = {
+    'thumbnail': (200, 200),
+    'card': (600, 600),
+    'full': (1600, 1600),
+}
+
+RECIPE_IMAGE_QUALITY = 85
+
+RECIPE_IMAGE_WORKERS = 2
+
+TOKEN_CACHE_TIMEOUT = 300
@@ -1,7 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import pre_migrate
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
     verbose_name = 'Рецепты'
+
+    def ready(self):
+        from . import signals
+
+        pre_migrate.connect(signals.create_trigram_extension, sender=self)
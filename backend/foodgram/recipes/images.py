@@ -0,0 +1,92 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+
+from foodgram import settings
+from PIL import Image
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix='recipe-images',
+)
+
+RENDITION_FIELDS = tuple(
+    f'image_{rendition}' for rendition in settings.RECIPE_IMAGE_RENDITIONS
+)
+
+
+def render(image, size):
+    rendition = image.copy()
+    rendition.thumbnail(size)
+    if rendition.mode != 'RGB':
+        rendition = rendition.convert('RGB')
+    buffer = BytesIO()
+    rendition.save(
+        buffer,
+        format='JPEG',
+        quality=settings.RECIPE_IMAGE_QUALITY,
+        optimize=True,
+        progressive=True,
+    )
+    return ContentFile(buffer.getvalue())
+
+
+def make_renditions(recipe_id):
+    """Создать уменьшенные копии изображения рецепта.
+
+    Копии сохраняются, только если за время обработки изображение
+    рецепта не было заменено.
+    """
+
+    recipe = Recipe.objects.only('image', *RENDITION_FIELDS).get(
+        pk=recipe_id
+    )
+    source = recipe.image.name
+    name = f'{os.path.splitext(os.path.basename(source))[0]}.jpg'
+    with recipe.image.open('rb') as file, Image.open(file) as image:
+        image.load()
+        for rendition, size in settings.RECIPE_IMAGE_RENDITIONS.items():
+            getattr(recipe, f'image_{rendition}').save(
+                name, render(image, size), save=False
+            )
+    Recipe.objects.filter(pk=recipe_id, image=source).update(
+        updated_at=timezone.now(),
+        **{field: getattr(recipe, field).name for field in RENDITION_FIELDS},
+    )
+
+
+def run(recipe_id):
+    try:
+        make_renditions(recipe_id)
+    except Recipe.DoesNotExist:
+        pass
+    except Exception:
+        logger.exception(
+            'Не удалось обработать изображение рецепта %s.', recipe_id
+        )
+    finally:
+        connections.close_all()
+
+
+def schedule_renditions(recipe):
+    """Сбросить устаревшие копии и поставить обработку в очередь.
+
+    Пока копии не готовы, сериализаторы отдают исходное изображение.
+    """
+
+    renditions = dict.fromkeys(RENDITION_FIELDS, '')
+    renditions['updated_at'] = timezone.now()
+    Recipe.objects.filter(pk=recipe.pk).update(**renditions)
+    for field, value in renditions.items():
+        setattr(recipe, field, value)
+    recipe_id = recipe.pk
+    transaction.on_commit(lambda: executor.submit(run, recipe_id))
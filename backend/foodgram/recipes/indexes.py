@@ -0,0 +1,304 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from fractions import Fraction
+
+from django.db import transaction
+
+from foodgram import settings
+
+from .models import Ingredient, RecipeIngredient, Tag
+
+
+def normalize(name):
+    return name.casefold().replace('ё', 'е').strip()
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Названия хранятся отсортированными, поиск по префиксу выполняется
+    бинарным поиском, затем добавляются совпадения по подстроке.
+    Индекс строится при первом обращении и перестраивается после
+    изменения ингредиентов или по истечении INGREDIENT_INDEX_TTL,
+    чтобы изменения из других процессов тоже были видны.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = None
+        self.items = None
+        self.version = None
+        self.updated_at = None
+        self.built_at = 0
+
+    def build(self):
+        ingredients = sorted(
+            Ingredient.objects.only(
+                'id', 'name', 'measurement_unit', 'updated_at'
+            ),
+            key=lambda ingredient: (normalize(ingredient.name), ingredient.id)
+        )
+        self.keys = [normalize(ingredient.name) for ingredient in ingredients]
+        self.items = ingredients
+        self.updated_at = max(
+            (ingredient.updated_at for ingredient in ingredients),
+            default=None,
+        )
+        self.version = f'{len(ingredients)}-{self.updated_at}'
+        self.built_at = time.monotonic()
+
+    def invalidate(self):
+        self.keys = None
+
+    def get_index(self):
+        with self.lock:
+            if (
+                self.keys is None
+                or time.monotonic() - self.built_at
+                > settings.INGREDIENT_INDEX_TTL
+            ):
+                self.build()
+            return self.keys, self.items
+
+    def get_version(self):
+        """Версия каталога, по которой построен индекс."""
+
+        self.get_index()
+        return self.version, self.updated_at
+
+    def search(self, name):
+        """Ингредиенты, начинающиеся с name, затем содержащие name."""
+
+        keys, items = self.get_index()
+        query = normalize(name)
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + chr(0x10FFFF), lo=start)
+        substring = [
+            item for key, item in zip(keys, items)
+            if query in key and not key.startswith(query)
+        ]
+        return items[start:end] + substring
+
+
+class TagRegistry:
+    """Соответствие слагов тегов их id в памяти процесса.
+
+    Перестраивается после изменения тегов или по истечении
+    TAG_REGISTRY_TTL, чтобы изменения из других процессов
+    тоже были видны.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = None
+        self.built_at = 0
+
+    def build(self):
+        self.ids = dict(Tag.objects.values_list('slug', 'id'))
+        self.built_at = time.monotonic()
+
+    def invalidate(self):
+        self.ids = None
+
+    def get_ids(self, slugs=()):
+        """Словарь слаг -> id тега.
+
+        Если каких-то из slugs в словаре нет, он перестраивается:
+        тег мог быть создан в другом процессе.
+        """
+
+        with self.lock:
+            if (
+                self.ids is None
+                or time.monotonic() - self.built_at
+                > settings.TAG_REGISTRY_TTL
+                or not self.ids.keys() >= set(slugs)
+            ):
+                self.build()
+            return self.ids
+
+
+def to_bitset(ids):
+    """Битовое множество: бит с номером id установлен для каждого id."""
+
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        data[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(data, 'little')
+
+
+def from_bitset(bitset):
+    """Номера установленных битов по возрастанию."""
+
+    data = bitset.to_bytes((bitset.bit_length() + 7) // 8, 'little')
+    return [
+        index * 8 + bit
+        for index, byte in enumerate(data) if byte
+        for bit in range(8) if byte >> bit & 1
+    ]
+
+
+def add_to_counter(planes, bitset):
+    """Прибавить единицу к счетчикам всех рецептов из bitset.
+
+    Счетчики хранятся поразрядно: planes[j] содержит j-й бит
+    счетчика каждого рецепта, сложение выполняется с переносом
+    сразу для всех рецептов.
+    """
+
+    carry = bitset
+    for index, plane in enumerate(planes):
+        if not carry:
+            return
+        planes[index], carry = plane ^ carry, plane & carry
+    if carry:
+        planes.append(carry)
+
+
+class RecipeInclusionIndex:
+    """Инвертированный индекс: ингредиент -> битовое множество рецептов.
+
+    Поиск рецептов по набору ингредиентов сводится к пересечениям,
+    объединениям и поразрядному подсчету совпадений без запросов
+    к RecipeIngredient. Индекс строится при первом обращении,
+    обновляется по рецепту из кода записи рецептов и
+    перестраивается по истечении RECIPE_INCLUSION_INDEX_TTL.
+    """
+
+    modes = ('all', 'any', 'only')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = None
+        self.recipes = None
+        self.size_planes = None
+        self.built_at = 0
+
+    def build(self):
+        recipes = defaultdict(set)
+        postings = defaultdict(list)
+        for ingredient_id, recipe_id in RecipeIngredient.objects.values_list(
+            'ingredient_id', 'recipe_id'
+        ).iterator():
+            recipes[recipe_id].add(ingredient_id)
+            postings[ingredient_id].append(recipe_id)
+        self.recipes = {
+            recipe_id: frozenset(ingredients)
+            for recipe_id, ingredients in recipes.items()
+        }
+        self.postings = {
+            ingredient_id: to_bitset(recipe_ids)
+            for ingredient_id, recipe_ids in postings.items()
+        }
+        max_size = max(map(len, self.recipes.values()), default=0)
+        self.size_planes = [
+            to_bitset([
+                recipe_id
+                for recipe_id, ingredients in self.recipes.items()
+                if len(ingredients) >> bit & 1
+            ])
+            for bit in range(max_size.bit_length())
+        ]
+        self.built_at = time.monotonic()
+
+    def ensure_built(self):
+        if (
+            self.recipes is None
+            or time.monotonic() - self.built_at
+            > settings.RECIPE_INCLUSION_INDEX_TTL
+        ):
+            self.build()
+
+    def invalidate(self):
+        self.recipes = None
+
+    def refresh(self, recipe_id):
+        """Обновить в индексе ингредиенты одного рецепта из базы."""
+
+        ingredients = frozenset(
+            RecipeIngredient.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', flat=True)
+        )
+        with self.lock:
+            if self.recipes is None:
+                return
+            bit = 1 << recipe_id
+            for ingredient_id in self.recipes.pop(recipe_id, ()):
+                self.postings[ingredient_id] &= ~bit
+            self.size_planes = [plane & ~bit for plane in self.size_planes]
+            if not ingredients:
+                return
+            self.recipes[recipe_id] = ingredients
+            for ingredient_id in ingredients:
+                self.postings[ingredient_id] = (
+                    self.postings.get(ingredient_id, 0) | bit
+                )
+            size = len(ingredients)
+            for index in range(size.bit_length()):
+                if index == len(self.size_planes):
+                    self.size_planes.append(0)
+                if size >> index & 1:
+                    self.size_planes[index] |= bit
+
+    def schedule_refresh(self, recipe_id):
+        """Обновить рецепт в индексе после фиксации транзакции."""
+
+        transaction.on_commit(lambda: self.refresh(recipe_id))
+
+    def search(self, ingredient_ids, mode='any'):
+        """Рецепты по набору ингредиентов и доля их покрытия.
+
+        all - рецепт содержит все ингредиенты, any - хотя бы один,
+        only - рецепт целиком состоит из переданных ингредиентов.
+        Возвращает пары (доля ингредиентов рецепта, входящих в набор;
+        id рецептов с такой долей) по убыванию доли.
+        """
+
+        with self.lock:
+            self.ensure_built()
+            postings = [
+                self.postings.get(ingredient_id, 0)
+                for ingredient_id in set(ingredient_ids)
+            ]
+            matched = []
+            found = 0
+            for posting in postings:
+                add_to_counter(matched, posting)
+                found |= posting
+            if mode == 'all':
+                for posting in postings:
+                    found &= posting
+            elif mode == 'only':
+                difference = 0
+                for index in range(
+                    max(len(matched), len(self.size_planes))
+                ):
+                    difference |= (
+                        (matched[index] if index < len(matched) else 0)
+                        ^ (
+                            self.size_planes[index]
+                            if index < len(self.size_planes) else 0
+                        )
+                    )
+                found &= ~difference
+            counts = dict.fromkeys(from_bitset(found), 0)
+            for index, plane in enumerate(matched):
+                for recipe_id in from_bitset(plane & found):
+                    counts[recipe_id] += 1 << index
+            groups = defaultdict(list)
+            for recipe_id, count in counts.items():
+                groups[count, len(self.recipes[recipe_id])].append(recipe_id)
+        coverage = defaultdict(list)
+        for (count, size), recipe_ids in groups.items():
+            coverage[Fraction(count, size)].extend(recipe_ids)
+        return sorted(coverage.items(), reverse=True)
+
+
+ingredient_index = IngredientIndex()
+tag_registry = TagRegistry()
+inclusion_index = RecipeInclusionIndex()
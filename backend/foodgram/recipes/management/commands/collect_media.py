@@ -0,0 +1,60 @@
+import os
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.images import RENDITION_FIELDS
+from recipes.models import Recipe
+
+MEDIA_DIRECTORY = 'recipes/images'
+
+
+class Command(BaseCommand):
+    help = 'Удаляет файлы изображений, на которые не ссылается ни один рецепт.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help=(
+                'Не удалять файлы моложе указанного числа секунд: '
+                'они могут относиться к незавершенной загрузке.'
+            ),
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать файлы, которые будут удалены.',
+        )
+
+    def walk(self, directory):
+        directories, files = default_storage.listdir(directory)
+        for name in files:
+            yield os.path.join(directory, name)
+        for name in directories:
+            yield from self.walk(os.path.join(directory, name))
+
+    def handle(self, *args, **options):
+        referenced = set()
+        for names in Recipe.objects.values_list(
+            'image', *RENDITION_FIELDS
+        ).iterator():
+            referenced.update(name for name in names if name)
+        threshold = timezone.now() - timedelta(seconds=options['min_age'])
+        removed = 0
+        for name in self.walk(MEDIA_DIRECTORY):
+            if name in referenced:
+                continue
+            if default_storage.get_modified_time(name) > threshold:
+                continue
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+            removed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Неиспользуемых файлов: {removed}.'
+        ))
@@ -0,0 +1,79 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from recipes.models import Recipe, RecipeIngredient
+
+
+def serialize(recipe):
+    return {
+        'author': recipe.author.email,
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'image': recipe.image.name,
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in recipe.recipe_ingredients.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает рецепты с тегами, ингредиентами и путями к изображениям '
+        'в формате JSON Lines.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='Путь к файлу, по умолчанию стандартный вывод.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Количество рецептов, загружаемых за один запрос.',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+        ).order_by('id')
+        path = options['path']
+        file = (
+            sys.stdout if path == '-'
+            else open(path, 'w', encoding='utf-8')
+        )
+        started = time.monotonic()
+        total = 0
+        try:
+            for recipe in recipes.iterator(chunk_size=options['chunk_size']):
+                file.write(json.dumps(serialize(recipe), ensure_ascii=False))
+                file.write('\n')
+                total += 1
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        elapsed = time.monotonic() - started
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {total} '
+            f'({total / elapsed if elapsed else 0:.0f} в секунду).'
+        ))
@@ -0,0 +1,224 @@
+import io
+import random
+import time
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from PIL import Image
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Follow, User
+
+IMAGE_SIZE = (64, 64)
+
+
+def zipf(count, skew):
+    """Накопленные веса распределения Ципфа для count элементов."""
+
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def sample(rng, population, cum_weights, count):
+    """До count различных элементов с учетом весов."""
+
+    count = min(count, len(population))
+    if not count:
+        return []
+    picks = dict.fromkeys(
+        rng.choices(population, cum_weights=cum_weights, k=count * 2)
+    )
+    return list(islice(picks, count))
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерирует воспроизводимый синтетический набор пользователей, '
+        'рецептов, подписок, избранного и списков покупок.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='Количество пользователей.',
+        )
+        parser.add_argument(
+            '--recipes-per-author', type=int, default=5,
+            help='Среднее количество рецептов у пользователя.',
+        )
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8,
+            help='Количество ингредиентов в рецепте.',
+        )
+        parser.add_argument(
+            '--tags-per-recipe', type=int, default=2,
+            help='Количество тегов у рецепта.',
+        )
+        parser.add_argument(
+            '--follows-per-user', type=int, default=10,
+            help='Количество подписок у пользователя.',
+        )
+        parser.add_argument(
+            '--favorites-per-user', type=int, default=20,
+            help='Количество рецептов в избранном у пользователя.',
+        )
+        parser.add_argument(
+            '--carts-per-user', type=int, default=3,
+            help='Количество рецептов в списке покупок у пользователя.',
+        )
+        parser.add_argument(
+            '--skew', type=float, default=1.0,
+            help=(
+                'Показатель распределения Ципфа для популярности авторов, '
+                'рецептов и ингредиентов; 0 - равномерное распределение.'
+            ),
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Начальное значение генератора случайных чисел.',
+        )
+        parser.add_argument(
+            '--prefix', default='load',
+            help='Префикс имен и адресов создаваемых пользователей.',
+        )
+        parser.add_argument(
+            '--password', default='password',
+            help='Пароль всех создаваемых пользователей.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество строк в одном INSERT.',
+        )
+
+    def insert(self, model, objects, name=None, return_ids=False):
+        """Вставить объекты пачками, каждую в своей транзакции.
+
+        Объекты не накапливаются: возвращаются id вставленных строк,
+        если return_ids истинно, иначе их количество.
+        """
+
+        ids = []
+        count = 0
+        started = time.monotonic()
+        while batch := list(islice(objects, self.batch_size)):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            count += len(batch)
+            if return_ids:
+                ids.extend(obj.id for obj in batch)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{name or model._meta.verbose_name_plural}: {count} '
+            f'({count / elapsed if elapsed else 0:.0f} '
+            f'строк в секунду).'
+        )
+        return ids if return_ids else count
+
+    def create_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', IMAGE_SIZE, (230, 160, 90)).save(buffer, 'JPEG')
+        return default_storage.save(
+            'recipes/images/generated.jpg', ContentFile(buffer.getvalue())
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        skew = options['skew']
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        if not ingredient_ids or not tag_ids:
+            raise CommandError(
+                'Сначала загрузите ингредиенты и создайте теги.'
+            )
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                'укажите другой --prefix.'
+            )
+        started = time.monotonic()
+
+        password = make_password(options['password'])
+        user_ids = self.insert(User, (
+            User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@example.com',
+                first_name='Имя',
+                last_name='Фамилия',
+                password=password,
+            )
+            for number in range(options['users'])
+        ), return_ids=True)
+        authors = user_ids[:]
+        rng.shuffle(authors)
+        author_weights = zipf(len(authors), skew)
+
+        image = self.create_image()
+        mean = options['recipes_per_author']
+        recipe_ids = self.insert(Recipe, (
+            Recipe(
+                author_id=author_id,
+                name=f'Рецепт {author_id}-{number}',
+                text='Описание рецепта.',
+                cooking_time=rng.randint(1, 180),
+                image=image,
+            )
+            for author_id in user_ids
+            for number in range(rng.randint(0, 2 * mean))
+        ), return_ids=True)
+
+        ingredient_weights = zipf(len(ingredient_ids), skew)
+        self.insert(RecipeIngredient, (
+            RecipeIngredient(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                amount=rng.randint(1, 500),
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in sample(
+                rng, ingredient_ids, ingredient_weights,
+                options['ingredients_per_recipe'],
+            )
+        ))
+        self.insert(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in rng.sample(
+                tag_ids, min(options['tags_per_recipe'], len(tag_ids))
+            )
+        ), name='Теги рецептов')
+
+        self.insert(Follow, (
+            Follow(user_id=user_id, following_id=author_id)
+            for user_id in user_ids
+            for author_id in sample(
+                rng, authors, author_weights, options['follows_per_user']
+            )
+            if author_id != user_id
+        ))
+        popular = recipe_ids[:]
+        rng.shuffle(popular)
+        recipe_weights = zipf(len(popular), skew)
+        for model, count in (
+            (Favorite, options['favorites_per_user']),
+            (ShoppingCart, options['carts_per_user']),
+        ):
+            self.insert(model, (
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in sample(rng, popular, recipe_weights, count)
+            ))
+
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_carts', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Набор данных создан за {time.monotonic() - started:.1f} с.'
+        ))
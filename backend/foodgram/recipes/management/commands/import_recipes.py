@@ -0,0 +1,262 @@
+import json
+import sys
+import time
+from collections import Counter
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import User
+
+FIELDS = (
+    'author', 'name', 'text', 'cooking_time', 'image', 'tags', 'ingredients',
+)
+STRING_FIELDS = ('author', 'name', 'text', 'image')
+INGREDIENT_FIELDS = {'name', 'measurement_unit', 'amount'}
+
+
+def read_lines(file, skip):
+    """Номера и содержимое строк; нечитаемые строки передаются в skip."""
+
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as error:
+            skip(number, f'{error}.')
+            continue
+        if not isinstance(item, dict):
+            skip(number, 'ожидается объект JSON.')
+            continue
+        missing = [field for field in FIELDS if field not in item]
+        if missing:
+            skip(number, f'нет полей {", ".join(missing)}.')
+            continue
+        yield number, item
+
+
+def get_field_errors(instance, exclude):
+    try:
+        instance.clean_fields(exclude=exclude)
+    except ValidationError as error:
+        return [
+            f'{field}: {message}'
+            for field, messages in error.message_dict.items()
+            for message in messages
+        ]
+    return []
+
+
+def get_errors(item):
+    """Ошибки, с которыми API не принял бы рецепт из строки."""
+
+    wrong = [
+        field for field in STRING_FIELDS if not isinstance(item[field], str)
+    ]
+    if wrong:
+        return [f'{", ".join(wrong)}: ожидается строка.']
+    tags, ingredients = item['tags'], item['ingredients']
+    if not isinstance(tags, list) or not all(
+        isinstance(slug, str) for slug in tags
+    ):
+        return ['tags: ожидается список слагов.']
+    if not isinstance(ingredients, list) or not all(
+        isinstance(ingredient, dict)
+        and INGREDIENT_FIELDS <= ingredient.keys()
+        and isinstance(ingredient['name'], str)
+        and isinstance(ingredient['measurement_unit'], str)
+        for ingredient in ingredients
+    ):
+        return [
+            'ingredients: ожидается список объектов со строковыми '
+            'полями name, measurement_unit и полем amount.'
+        ]
+    errors = []
+    if not tags:
+        errors.append('Теги должны быть заданы.')
+    elif len(set(tags)) != len(tags):
+        errors.append('Такой тег уже в рецепте.')
+    keys = [
+        (ingredient['name'], ingredient['measurement_unit'])
+        for ingredient in ingredients
+    ]
+    if not keys:
+        errors.append('Ингредиенты должны быть заданы.')
+    elif len(set(keys)) != len(keys):
+        errors.append('Такой ингредиент уже в рецепте.')
+    errors += get_field_errors(
+        Recipe(
+            name=item['name'],
+            text=item['text'],
+            cooking_time=item['cooking_time'],
+            image=item['image'],
+        ),
+        exclude=('author',),
+    )
+    for ingredient in ingredients:
+        errors += get_field_errors(
+            RecipeIngredient(amount=ingredient['amount']),
+            exclude=('recipe', 'ingredient'),
+        )
+    return errors
+
+
+def get_ingredient_ids(items):
+    """id ингредиентов по парам (название, единица) одним запросом."""
+
+    keys = {
+        (ingredient['name'], ingredient['measurement_unit'])
+        for item in items for ingredient in item['ingredients']
+    }
+    return {
+        (name, measurement_unit): pk
+        for pk, name, measurement_unit in Ingredient.objects.filter(
+            name__in={name for name, _ in keys}
+        ).values_list('id', 'name', 'measurement_unit')
+        if (name, measurement_unit) in keys
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает рецепты из файла JSON Lines, созданного '
+        'командой export_recipes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='Путь к файлу, по умолчанию стандартный ввод.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Количество рецептов в одной транзакции.',
+        )
+
+    def skip(self, number, message):
+        self.stderr.write(f'Строка {number} пропущена: {message}')
+
+    def import_chunk(self, chunk):
+        """Сохранить пачку рецептов, вернуть число вставленных строк.
+
+        Строки с ошибками пропускаются. Если пачка не сохранилась
+        из-за нарушения ограничений базы, ее строки сохраняются
+        по одной, чтобы пропустить только ошибочные.
+        """
+
+        valid = []
+        for number, item in chunk:
+            errors = get_errors(item)
+            if errors:
+                self.skip(number, ' '.join(errors))
+            else:
+                valid.append((number, item))
+        try:
+            return self.save_chunk(valid)
+        except IntegrityError as error:
+            if len(valid) == 1:
+                self.skip(valid[0][0], f'{error}.')
+                return 0, 0
+            totals = [self.import_chunk([line]) for line in valid]
+            return (
+                sum(recipes for recipes, _ in totals),
+                sum(rows for _, rows in totals),
+            )
+
+    def save_chunk(self, chunk):
+        items = [item for _, item in chunk]
+        authors = User.objects.in_bulk(
+            {item['author'] for item in items}, field_name='email'
+        )
+        tags = Tag.objects.in_bulk(
+            {slug for item in items for slug in item['tags']},
+            field_name='slug',
+        )
+        ingredients = get_ingredient_ids(items)
+        recipes, rows = [], []
+        for number, item in chunk:
+            missing = (
+                [item['author']] if item['author'] not in authors else []
+            ) + [
+                slug for slug in item['tags'] if slug not in tags
+            ] + [
+                ingredient['name'] for ingredient in item['ingredients']
+                if (ingredient['name'], ingredient['measurement_unit'])
+                not in ingredients
+            ]
+            if missing:
+                self.skip(number, f'не найдены {", ".join(missing)}.')
+                continue
+            recipes.append(Recipe(
+                author=authors[item['author']],
+                name=item['name'],
+                text=item['text'],
+                cooking_time=item['cooking_time'],
+                image=item['image'],
+            ))
+            rows.append(item)
+        with transaction.atomic():
+            Recipe.objects.bulk_create(recipes)
+            recipe_tags = Recipe.tags.through.objects.bulk_create(
+                Recipe.tags.through(recipe_id=recipe.id, tag_id=tags[slug].id)
+                for recipe, item in zip(recipes, rows)
+                for slug in item['tags']
+            )
+            recipe_ingredients = RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe_id=recipe.id,
+                    ingredient_id=ingredients[
+                        ingredient['name'], ingredient['measurement_unit']
+                    ],
+                    amount=ingredient['amount'],
+                )
+                for recipe, item in zip(recipes, rows)
+                for ingredient in item['ingredients']
+            )
+            for author_id, count in Counter(
+                recipe.author_id for recipe in recipes
+            ).items():
+                User.objects.filter(pk=author_id).update(
+                    recipes_count=F('recipes_count') + count
+                )
+        return len(recipes), (
+            len(recipes) + len(recipe_tags) + len(recipe_ingredients)
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file = (
+            sys.stdin if path == '-'
+            else open(path, encoding='utf-8')
+        )
+        started = time.monotonic()
+        total_recipes = total_rows = 0
+        try:
+            lines = read_lines(file, self.skip)
+            while chunk := list(islice(lines, options['chunk_size'])):
+                recipes, rows = self.import_chunk(chunk)
+                total_recipes += recipes
+                total_rows += rows
+                elapsed = time.monotonic() - started
+                if options['verbosity'] > 1:
+                    self.stdout.write(
+                        f'Загружено рецептов: {total_recipes}, '
+                        f'{total_rows / elapsed:.0f} строк в секунду.'
+                    )
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {total_recipes}, строк: {total_rows} '
+            f'({total_rows / elapsed if elapsed else 0:.0f} в секунду).'
+        ))
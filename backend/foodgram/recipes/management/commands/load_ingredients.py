@@ -0,0 +1,91 @@
+import csv
+import json
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import Ingredient
+
+READ_SIZE = 64 * 1024
+
+
+def normalize(value):
+    return ' '.join(value.split())
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """Построчно разбирает JSON-массив объектов, не читая файл целиком."""
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: file.read(READ_SIZE), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and buffer[position:position + 1] == '[':
+                started = True
+                position += 1
+                continue
+            if buffer[position:position + 1] in ('', ']'):
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item['name'], item['measurement_unit']
+        buffer = buffer[position:]
+    if buffer.strip() not in ('', ']'):
+        raise CommandError('Некорректный JSON-файл.')
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV- или JSON-файла.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с ингредиентами.')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество ингредиентов в одном INSERT.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        before = Ingredient.objects.count()
+        total = 0
+        with open(path, encoding='utf-8') as file:
+            ingredients = (
+                Ingredient(
+                    name=normalize(name),
+                    measurement_unit=normalize(measurement_unit).lower(),
+                )
+                for name, measurement_unit in reader(file)
+            )
+            while batch := list(islice(ingredients, options['batch_size'])):
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+                total += len(batch)
+        created = Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано: {total}, добавлено: {created}, '
+            f'пропущено дубликатов: {total - created}.'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from recipes.images import RENDITION_FIELDS, make_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создает недостающие копии изображений рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересоздать копии для всех рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if not options['all']:
+            missing = Q()
+            for field in RENDITION_FIELDS:
+                missing |= Q(**{field: ''})
+            recipes = recipes.filter(missing)
+        total = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            make_renditions(recipe_id)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {total}.'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import CartIngredient, ShoppingCart
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает суммарные списки покупок пользователей.'
+
+    def handle(self, *args, **options):
+        user_ids = set(
+            ShoppingCart.objects.values_list('user', flat=True)
+        ) | set(
+            CartIngredient.objects.values_list('user', flat=True)
+        )
+        CartIngredient.objects.refresh(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересчитаны: {len(user_ids)}.'
+        ))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow, User
+
+
+def count_of(model, field):
+    """Подзапрос количества строк model, ссылающихся на объект по field."""
+
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
+
+
+def reconcile(model, counters):
+    """Исправить расхождения счетчиков, обновив только неверные строки."""
+
+    drifted = Q()
+    for field, actual in counters.items():
+        drifted |= ~Q(**{field: actual})
+    return model.objects.filter(drifted).update(**counters)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счетчики избранного, списков покупок, '
+        'подписчиков и рецептов.'
+    )
+
+    def handle(self, *args, **options):
+        recipes = reconcile(Recipe, {
+            'favorites_count': count_of(Favorite, 'recipe'),
+            'carts_count': count_of(ShoppingCart, 'recipe'),
+        })
+        users = reconcile(User, {
+            'followers_count': count_of(Follow, 'following'),
+            'recipes_count': count_of(Recipe, 'author'),
+        })
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики исправлены: рецептов {recipes}, '
+            f'пользователей {users}.'
+        ))
@@ -1,13 +1,24 @@
+import threading
+
+from django.contrib.postgres.indexes import OpClass
+from django.contrib.postgres.search import SearchVector
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Sum
+from django.db.models.functions import Upper
 
+from foodgram.indexes import PostgresGinIndex
+from foodgram.locks import lock_rows
 from foodgram.settings import (HEX_LEN, MAX_COOKING_TIME, MAX_INGR_AMOUNT,
                                MEASURE_UNIT_LEN, MIN_COOKING_TIME,
-                               MIN_INGR_AMOUNT, NAME_LEN, SLUG_LEN, TAG_LEN)
+                               MIN_INGR_AMOUNT, NAME_LEN, SEARCH_CONFIG,
+                               SLUG_LEN, TAG_LEN)
 from users.models import User
 
 from .validators import validate_hex
 
+PENDING_REFRESH = threading.local()
+
 
 class Tag(models.Model):
     """Модель тега."""
@@ -28,6 +39,10 @@ class Tag(models.Model):
         unique=True,
         max_length=SLUG_LEN,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата и время изменения',
+        auto_now=True,
+    )
 
     class Meta:
         ordering = ('name',)
@@ -49,11 +64,27 @@ class Ingredient(models.Model):
         verbose_name='Единица измерения',
         max_length=MEASURE_UNIT_LEN,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата и время изменения',
+        auto_now=True,
+    )
 
     class Meta:
         ordering = ('name',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='Ингредиент с такой единицей измерения уже есть.'
+            ),
+        )
+        indexes = (
+            PostgresGinIndex(
+                OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='ingredient_name_trgm_idx',
+            ),
+        )
 
     def __str__(self):
         return f'{self.name} - {self.measurement_unit}'
@@ -76,6 +107,21 @@ class Recipe(models.Model):
         verbose_name='Изображение',
         upload_to='recipes/images/',
     )
+    image_thumbnail = models.ImageField(
+        verbose_name='Миниатюра для списков',
+        upload_to='recipes/images/thumbnails/',
+        blank=True,
+    )
+    image_card = models.ImageField(
+        verbose_name='Изображение для карточки',
+        upload_to='recipes/images/cards/',
+        blank=True,
+    )
+    image_full = models.ImageField(
+        verbose_name='Изображение в полном размере',
+        upload_to='recipes/images/full/',
+        blank=True,
+    )
     text = models.TextField(
         verbose_name='Описание',
     )
@@ -108,11 +154,43 @@ class Recipe(models.Model):
         verbose_name='Дата и время публикации рецепта',
         auto_now_add=True,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата и время изменения рецепта',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлено в избранное',
+        default=0,
+        editable=False,
+    )
+    carts_count = models.PositiveIntegerField(
+        verbose_name='Добавлено в списки покупок',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            PostgresGinIndex(
+                SearchVector('name', 'text', config=SEARCH_CONFIG),
+                name='recipe_search_idx',
+            ),
+            PostgresGinIndex(
+                OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='recipe_name_trgm_idx',
+            ),
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=('-favorites_count', '-pub_date'),
+                name='recipe_popular_idx',
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -220,3 +298,121 @@ class ShoppingCart(AbstractFavoriteCart):
 
     def __str__(self):
         return f'{self.user.username} добавил в корзину {self.recipe.name}'
+
+
+class CartIngredientManager(models.Manager):
+    """Поддержка суммарного списка покупок пользователя."""
+
+    def add_recipes(self, user, recipe_ids):
+        """Прибавить ингредиенты рецептов к списку покупок пользователя."""
+
+        if not recipe_ids:
+            return
+        amounts = dict(
+            RecipeIngredient.objects
+            .filter(recipe_id__in=recipe_ids)
+            .values('ingredient_id')
+            .annotate(total=Sum('amount'))
+            .order_by()
+            .values_list('ingredient_id', 'total')
+        )
+        with transaction.atomic():
+            lock_rows(User.objects.filter(pk=user.pk))
+            totals = {
+                item.ingredient_id: item
+                for item in self.filter(
+                    user=user, ingredient_id__in=amounts
+                )
+            }
+            created, updated = [], []
+            for ingredient_id, amount in amounts.items():
+                item = totals.get(ingredient_id)
+                if item is None:
+                    created.append(self.model(
+                        user=user,
+                        ingredient_id=ingredient_id,
+                        amount=amount,
+                    ))
+                    continue
+                item.amount += amount
+                updated.append(item)
+            self.bulk_create(created)
+            self.bulk_update(updated, ('amount',))
+
+    def schedule_refresh(self, user_ids):
+        """Пересчитать списки покупок после фиксации транзакции.
+
+        Пользователи из всех вызовов до фиксации собираются вместе и
+        пересчитываются одним вызовом refresh. Если транзакция
+        откатилась, они будут пересчитаны вместе со следующей.
+        """
+        pending = PENDING_REFRESH.__dict__.setdefault('user_ids', set())
+        pending.update(user_ids)
+        transaction.on_commit(self.refresh_pending)
+
+    def refresh_pending(self):
+        user_ids = PENDING_REFRESH.__dict__.pop('user_ids', None)
+        if user_ids:
+            self.refresh(user_ids)
+
+    def refresh(self, user_ids):
+        """Пересчитать списки покупок пользователей с нуля."""
+
+        user_ids = list(user_ids)
+        totals = (
+            RecipeIngredient.objects
+            .filter(recipe__carts__user__in=user_ids)
+            .values('recipe__carts__user', 'ingredient')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+        with transaction.atomic():
+            lock_rows(User.objects.filter(pk__in=user_ids))
+            self.filter(user__in=user_ids).delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=item['recipe__carts__user'],
+                        ingredient_id=item['ingredient'],
+                        amount=item['total'],
+                    )
+                    for item in totals.iterator()
+                ),
+                batch_size=1000,
+            )
+
+
+class CartIngredient(models.Model):
+    """Модель суммарного количества ингредиента в корзине."""
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество ингредиента',
+    )
+
+    objects = CartIngredientManager()
+
+    class Meta:
+        ordering = ('ingredient__name',)
+        verbose_name = 'Ингредиент корзины'
+        verbose_name_plural = 'Ингредиенты корзины'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='Ингредиент корзины уникален.'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient}: {self.amount}'
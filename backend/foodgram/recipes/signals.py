@@ -0,0 +1,72 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from foodgram.counters import change_counter, get_counter_delta
+from users.models import User
+
+from .indexes import ingredient_index, tag_registry
+from .models import (CartIngredient, Favorite, Ingredient, Recipe,
+                     RecipeIngredient, ShoppingCart, Tag)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_registry(**kwargs):
+    tag_registry.invalidate()
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def refresh_cart(signal, instance, created=False, **kwargs):
+    if created or signal is post_delete:
+        CartIngredient.objects.schedule_refresh((instance.user_id,))
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def count_carts(signal, instance, created=False, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id),
+        'carts_count',
+        get_counter_delta(signal, created),
+    )
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def count_favorites(signal, instance, created=False, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id),
+        'favorites_count',
+        get_counter_delta(signal, created),
+    )
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def count_recipes(signal, instance, created=False, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id),
+        'recipes_count',
+        get_counter_delta(signal, created),
+    )
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def refresh_carts_on_ingredient_change(instance, **kwargs):
+    CartIngredient.objects.schedule_refresh(
+        ShoppingCart.objects.filter(
+            recipe_id=instance.recipe_id
+        ).values_list('user', flat=True)
+    )
+
+
+def create_trigram_extension(using, **kwargs):
+    """Подключает pg_trgm до миграций с триграммными индексами."""
+
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
@@ -0,0 +1,37 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, называющее файлы по SHA-256 их содержимого.
+
+    Одинаковые файлы хранятся один раз: если файл с таким хэшем уже
+    есть, запись пропускается, а время изменения файла обновляется,
+    чтобы collect_media не удалил его как старый и неиспользуемый,
+    пока на него ставится новая ссылка. Содержимое файла по одному пути никогда
+    не меняется, поэтому его можно кэшировать как immutable.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest[:2], f'{digest}{extension}')
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return super().save(name, content, max_length=max_length)
+        return name
@@ -0,0 +1,65 @@
+import copy
+
+from django.core.cache import cache
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram import settings
+
+# Хэш пароля и счетчики, которые меняются через F() без сигналов.
+UNCACHED_USER_FIELDS = ('password', 'followers_count', 'recipes_count')
+
+
+def get_token_cache_key(key):
+    return f'auth_token:{key}'
+
+
+def invalidate_token(key):
+    """Удалить пользователя токена из кэша."""
+
+    cache.delete(get_token_cache_key(key))
+
+
+def get_cacheable_token(token):
+    """Копия токена для кэша без полей UNCACHED_USER_FIELDS.
+
+    Эти поля у копии пользователя отложены: при обращении они
+    загружаются из базы данных, а save() без update_fields
+    записывает только загруженные поля и не затирает их
+    устаревшими значениями.
+    """
+
+    user = copy.copy(token.user)
+    for field in UNCACHED_USER_FIELDS:
+        user.__dict__.pop(field, None)
+    token = copy.copy(token)
+    token.user = user
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену с кэшированием пользователя.
+
+    Пользователь хранится в кэше не дольше TOKEN_CACHE_TIMEOUT секунд,
+    без хэша пароля и счетчиков. Удаление токена, изменение или
+    удаление пользователя сразу удаляют запись (users.signals),
+    поэтому кэш должен быть общим для всех процессов: без REDIS_URL
+    используется обычный TokenAuthentication.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(
+                cache_key,
+                get_cacheable_token(token),
+                settings.TOKEN_CACHE_TIMEOUT,
+            )
+            return user, token
+        if not cached.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                'User inactive or deleted.'
+            )
+        return cached.user, cached
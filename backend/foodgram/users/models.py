@@ -1,7 +1,10 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import OpClass
 from django.db import models
+from django.db.models.functions import Upper
 
 from foodgram import settings
+from foodgram.indexes import PostgresGinIndex
 
 from .validators import validate_username
 
@@ -28,6 +31,16 @@ class User(AbstractUser):
         verbose_name='Фамилия',
         max_length=settings.LAST_NAME_LEN,
     )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = (
         'username',
@@ -39,6 +52,12 @@ class User(AbstractUser):
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
         ordering = ('email',)
+        indexes = (
+            PostgresGinIndex(
+                OpClass(Upper('username'), name='gin_trgm_ops'),
+                name='user_username_trgm_idx',
+            ),
+        )
 
     def __str__(self):
         return self.email
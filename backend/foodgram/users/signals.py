@@ -0,0 +1,32 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from foodgram.counters import change_counter, get_counter_delta
+
+from .authentication import invalidate_token
+from .models import Follow, User
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_user_tokens(instance, created=False, **kwargs):
+    if created:
+        return
+    for key in Token.objects.filter(user=instance).values_list(
+        'key', flat=True
+    ):
+        invalidate_token(key)
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def count_followers(signal, instance, created=False, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.following_id),
+        'followers_count',
+        get_counter_delta(signal, created),
+    )